@@ -1,4 +1,8 @@
-from trace_baml_function import start_baml_trace, trace_baml_function
+import asyncio
+import sys
+from typing import Any, Iterable
+
+from trace_baml_function import a_trace_baml_function, start_baml_trace
 from baml_client import b
 
 inventory_text: str = '''
@@ -9,32 +13,47 @@ Current Stock:
 '''
 update_message: str = "I just received a shipment of 20 apples, and sold 5 oranges."
 
-# Standalone trace example
-items_single = trace_baml_function(b.ListInventory, inventory_text)
-print("Single-call trace items:")
-for item in items_single:
-    print(f"{item.item}: {item.quantity} units at ${item.price} each (SKU: {item.sku})")
-
-# Multi-call trace example
-with start_baml_trace("baml_inventory_multi") as (req_id, root_id):
-    items1 = trace_baml_function(
-        b.ListInventory,
-        inventory_text,
-        request_id=req_id,
-        parent_id=root_id
-    )
-    items2 = trace_baml_function(
-        b.UpdateInventory,
-        items1, # Use the items from the first call
-        update_message,
-        request_id=req_id,
-        parent_id=root_id
+
+def format_items(items: Iterable[Any]) -> str:
+    """Format inventory items one per line, for printing with a single write."""
+    return "".join(
+        f"{i.item}: {i.quantity} units at ${i.price} each (SKU: {i.sku})\n" for i in items
     )
 
-print("Multi-call trace initial items:")
-for item in items1:
-    print(f"{item.item}: {item.quantity} units at ${item.price} each (SKU: {item.sku})")
 
-print("Multi-call trace updated items:")
-for item in items2:
-    print(f"{item.item}: {item.quantity} units at ${item.price} each (SKU: {item.sku})")
\ No newline at end of file
+async def main() -> None:
+    with start_baml_trace("baml_inventory_multi", with_collector=True) as (req_id, root_id, collector):
+        # The standalone trace and the first call of the multi-call trace don't
+        # depend on each other, so they run concurrently
+        items_single, items1 = await asyncio.gather(
+            # Standalone trace example
+            a_trace_baml_function(b.ListInventory, inventory_text),
+            # Multi-call trace example
+            a_trace_baml_function(
+                b.ListInventory,
+                inventory_text,
+                request_id=req_id,
+                parent_id=root_id,
+                collector=collector
+            )
+        )
+        items2 = await a_trace_baml_function(
+            b.UpdateInventory,
+            items1, # Use the items from the first call
+            update_message,
+            request_id=req_id,
+            parent_id=root_id,
+            collector=collector
+        )
+
+    print("Single-call trace items:")
+    sys.stdout.write(format_items(items_single))
+
+    print("Multi-call trace initial items:")
+    sys.stdout.write(format_items(items1))
+
+    print("Multi-call trace updated items:")
+    sys.stdout.write(format_items(items2))
+
+
+asyncio.run(main())
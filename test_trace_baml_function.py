@@ -0,0 +1,133 @@
+'''
+Regression tests for the span queue and result cache in trace_baml_function.
+
+These exercise the plain Python helpers against a stub client, so no MLflow
+tracking server or LLM credentials are needed.
+'''
+
+import logging
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+pytest.importorskip("mlflow")
+pytest.importorskip("baml_py")
+
+import trace_baml_function as tbf
+from pydantic import BaseModel
+
+
+class RecordingClient:
+    """Stand-in for MlflowClient that records span calls instead of exporting them."""
+
+    def __init__(self) -> None:
+        self.events: List[Tuple[str, str, Optional[str]]] = []
+        self._names: Dict[str, str] = {}
+
+    def start_span(self, name: str, request_id: str, parent_id: str, **kwargs: Any) -> SimpleNamespace:
+        span_id = f"span{len(self._names) + 1}"
+        self._names[span_id] = name
+        self.events.append(("start", name, parent_id))
+        return SimpleNamespace(span_id=span_id)
+
+    def end_span(self, request_id: str, span_id: str, **kwargs: Any) -> None:
+        self.events.append(("end", self._names[span_id], None))
+
+
+def _add(queue: tbf._SpanQueue, name: str, parent_key: Optional[str]) -> str:
+    return queue.add(
+        name=name,
+        parent_key=parent_key,
+        span_type="AGENT",
+        attributes={},
+        inputs={},
+        outputs={},
+        start_ns=0,
+        end_ns=1
+    )
+
+
+def test_flush_starts_parents_first_and_ends_them_last() -> None:
+    queue = tbf._SpanQueue(request_id="req", parent_id="root")
+    parent = _add(queue, "parent", None)
+    _add(queue, "child1", parent)
+    _add(queue, "child2", parent)
+    _add(queue, "sibling", None)
+
+    client = RecordingClient()
+    queue.flush(client)
+
+    assert client.events == [
+        ("start", "parent", "root"),
+        ("start", "child1", "span1"),
+        ("end", "child1", None),
+        ("start", "child2", "span1"),
+        ("end", "child2", None),
+        ("end", "parent", None),
+        ("start", "sibling", "root"),
+        ("end", "sibling", None),
+    ]
+    assert queue.spans == []
+
+
+def test_flush_skips_orphans_with_a_warning(caplog: pytest.LogCaptureFixture) -> None:
+    queue = tbf._SpanQueue(request_id="req", parent_id="root")
+    _add(queue, "orphan", "missing")
+    _add(queue, "kept", None)
+
+    client = RecordingClient()
+    with caplog.at_level(logging.WARNING, logger=tbf.logger.name):
+        queue.flush(client)
+
+    assert client.events == [("start", "kept", "root"), ("end", "kept", None)]
+    assert "Skipped 1 BAML spans with an unknown parent in trace req" in caplog.text
+
+
+class SameRepr(BaseModel):
+    """Model whose repr hides its contents, so repr-based keys would collide."""
+    value: int
+
+    def __repr__(self) -> str:
+        return "SameRepr()"
+
+
+def list_inventory(text: str) -> List[str]:
+    return [text]
+
+
+def test_cache_key_distinguishes_inputs_with_identical_repr() -> None:
+    first, second = SameRepr(value=1), SameRepr(value=2)
+    assert repr(first) == repr(second)
+
+    key = tbf._cache_key(list_inventory, (first,), {})
+    assert key != tbf._cache_key(list_inventory, (second,), {})
+    assert key == tbf._cache_key(list_inventory, (SameRepr(value=1),), {})
+
+
+def test_cache_key_skips_unserializable_arguments() -> None:
+    class Opaque:
+        pass
+
+    assert tbf._cache_key(list_inventory, (Opaque(),), {}) is None
+
+
+def test_result_cache_evicts_least_recently_used(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(tbf, "_RESULT_CACHE", OrderedDict())
+    monkeypatch.setattr(tbf, "_RESULT_CACHE_SIZE", 2)
+    keys = []
+    for i in range(3):
+        key = tbf._cache_key(list_inventory, (f"text{i}",), {})
+        assert key is not None
+        keys.append(key)
+
+    tbf._cache_put(keys[0], "result0")
+    tbf._cache_put(keys[1], "result1")
+    assert tbf._cache_get(keys[0]) == (True, "result0")  # now most recently used
+    tbf._cache_put(keys[2], "result2")
+
+    assert len(tbf._RESULT_CACHE) == 2
+    assert tbf._cache_get(keys[1]) == (False, None)
+    assert tbf._cache_get(keys[0]) == (True, "result0")
+    assert tbf._cache_get(keys[2]) == (True, "result2")
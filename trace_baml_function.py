@@ -3,9 +3,34 @@ Module for tracing BAML client function calls and logging them to MLflow,
 with automatic standalone trace creation and multi-call trace grouping via start_baml_trace.
 '''
 
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import sys
+import threading
+import time
 import traceback
+import weakref
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Any, Optional, Tuple, Iterator, Callable
+from dataclasses import dataclass, field
+from functools import partial
+from typing import (
+    Any, Optional, Tuple, Iterator, Iterable, Callable, List, Dict, NamedTuple, Union,
+    ContextManager, Literal, overload
+)
+from uuid import uuid4
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib parser is used without it
+    orjson = None  # type: ignore[assignment]
 
 from baml_client import b
 from baml_py import Collector
@@ -13,32 +38,465 @@ from baml_py.errors import BamlError
 from mlflow import MlflowClient, set_experiment
 from mlflow.entities.span import SpanType
 from mlflow.tracing import set_span_chat_messages, set_span_chat_tools
+from pydantic import BaseModel
 
-@contextmanager
-def start_baml_trace(experiment: str) -> Iterator[Tuple[str, str]]:
+logger = logging.getLogger(__name__)
+
+# Fraction of standalone traces to record; the rest run the BAML function untraced
+BAML_TRACE_SAMPLE_RATE = float(os.getenv("BAML_TRACE_SAMPLE_RATE", "1.0"))
+
+# Export jobs run in order on a background thread, off the caller's critical path
+_EXPORT_QUEUE: "queue.Queue[Callable[[], None]]" = queue.Queue()
+# Seconds the exit hook waits for queued exports before giving up
+_EXIT_FLUSH_TIMEOUT = 30.0
+
+# Recorded on function spans so concurrent sibling calls can be told apart
+_HOSTNAME = socket.gethostname()
+
+# One client for the whole process, so its store/engine is only built once
+_CLIENT: Optional[MlflowClient] = None
+_CLIENT_LOCK = threading.Lock()
+# (name, experiment_id) of the last experiment passed to set_experiment
+_current_experiment: Optional[Tuple[str, str]] = None
+# Root span_id of each trace opened by start_baml_trace, keyed by request_id
+_REQ_ROOT: Dict[str, str] = {}
+# Results of successful calls made with use_cache, most recently used last
+_RESULT_CACHE: "OrderedDict[Tuple[Any, Any, str], Any]" = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+_RESULT_CACHE_SIZE = 256
+
+
+def _get_client() -> MlflowClient:
+    """Return the shared MlflowClient, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = MlflowClient()
+    return _CLIENT
+
+
+def _set_experiment(experiment: str) -> str:
+    """Activate an experiment by name, skipping the lookup if it is already active."""
+    global _current_experiment
+    current = _current_experiment
+    if current is None or current[0] != experiment:
+        current = (experiment, set_experiment(experiment).experiment_id)
+        _current_experiment = current
+    return current[1]
+
+
+def _json_loads(text: str) -> Any:
+    """
+    Parse a JSON body, with orjson when it is installed.
+
+    orjson rejects NaN and Infinity, which json accepts, so those bodies fall back to json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def _json_default(obj: Any) -> Any:
+    """json.dumps fallback that serializes pydantic models and rejects everything else."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _cache_key(
+    func: Callable[..., Any],
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any]
+) -> Optional[Tuple[Any, Any, str]]:
+    """
+    Build the result-cache key for a BAML call, or None if its arguments can't be cached.
+
+    The key holds the client object func is bound to, the underlying function, and a
+    hash of the arguments' canonical JSON. Client options such as a client registry
+    have no stable identity, so only calls through the same client object share entries;
+    each b.with_options(...) call returns a new client. The client is held by weak
+    reference, so cache entries don't keep it alive, and a dead reference never
+    matches a new client that happens to reuse its memory address.
+    """
+    try:
+        payload = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True, default=_json_default)
+    except (TypeError, ValueError):
+        return None
+    owner = getattr(func, "__self__", None)
+    if owner is not None:
+        try:
+            owner = weakref.ref(owner)
+        except TypeError:  # not weak-referenceable; keep a strong reference instead
+            pass
+    return (
+        owner,
+        getattr(func, "__func__", func),
+        hashlib.blake2b(payload.encode()).hexdigest()
+    )
+
+
+def _cache_get(key: Tuple[Any, Any, str]) -> Tuple[bool, Any]:
+    """Return (True, result) for a cached key, or (False, None) on a miss."""
+    with _RESULT_CACHE_LOCK:
+        if key not in _RESULT_CACHE:
+            return False, None
+        _RESULT_CACHE.move_to_end(key)
+        return True, _RESULT_CACHE[key]
+
+
+def _cache_put(key: Tuple[Any, Any, str], result: Any) -> None:
+    """Store a result, evicting the least recently used entry when full."""
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = result
+        _RESULT_CACHE.move_to_end(key)
+        if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+
+
+def _truncate_for_span(obj: Any, max_len: int = 2048) -> Any:
+    """
+    Return a detached copy of obj for span data, or a truncated repr if it is too large.
+
+    Pydantic models are dumped to dicts. Values whose JSON form fits in max_len
+    characters are returned as a fresh copy decoded from that JSON, so MLflow still
+    renders them as JSON and later changes to obj don't reach the span.
+    Anything else is recorded as its repr, cut to max_len characters.
+    """
+    if isinstance(obj, BaseModel):
+        obj = obj.model_dump(mode="json")
+    try:
+        text = json.dumps(obj, default=_json_default)
+        if len(text) <= max_len:
+            return json.loads(text)
+    except (TypeError, ValueError):
+        pass
+    text = repr(obj)
+    if len(text) <= max_len:
+        return text
+    return f"{text[:max_len]}... [{len(text) - max_len} chars truncated]"
+
+
+def _span_inputs(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Snapshot a call's arguments as function span inputs.
+
+    Called on the caller's thread before the export is queued, so the span shows the
+    arguments as they were at call time and the queued job holds no caller objects.
+    """
+    return {'args': _truncate_for_span(args), 'kwargs': _truncate_for_span(kwargs)}
+
+
+def _export_worker() -> None:
+    """Run queued export jobs one at a time for the life of the process."""
+    while True:
+        job = _EXPORT_QUEUE.get()
+        try:
+            job()
+        except Exception:
+            logger.exception("Failed to export BAML trace data to MLflow")
+        finally:
+            _EXPORT_QUEUE.task_done()
+
+
+_EXPORT_THREAD = threading.Thread(target=_export_worker, name="baml_mlflow_export", daemon=True)
+_EXPORT_THREAD.start()
+
+
+def flush_baml_traces(timeout: Optional[float] = None) -> bool:
+    """
+    Wait until every span and trace queued so far has been exported to MLflow.
+
+    Call this after a start_baml_trace block before reading the trace back, e.g.
+    with mlflow.get_trace. Export failures are logged, not raised.
+
+    Args:
+        timeout (Optional[float]): Maximum number of seconds to wait. Defaults to None (no limit).
+
+    Returns:
+        bool: True if the queue was drained, False if the timeout expired or the export thread is not running.
+    """
+    if not _EXPORT_THREAD.is_alive():
+        logger.error("BAML trace export thread is not running; %d jobs were not exported", _EXPORT_QUEUE.qsize())
+        return False
+    # The worker runs jobs in order, so this marker is reached after everything queued before it
+    done = threading.Event()
+    _EXPORT_QUEUE.put(done.set)
+    return done.wait(timeout)
+
+
+def _flush_at_exit() -> None:
+    """Flush pending exports before the interpreter exits, without hanging on an unreachable server."""
+    if not flush_baml_traces(timeout=_EXIT_FLUSH_TIMEOUT):
+        logger.warning("Timed out after %ss exporting BAML traces to MLflow at exit", _EXIT_FLUSH_TIMEOUT)
+
+
+atexit.register(_flush_at_exit)
+
+
+class _SpanRecord(NamedTuple):
+    """A span captured from a BAML log, waiting to be emitted to MLflow."""
+    key: str
+    name: str
+    parent_key: Optional[str]
+    span_type: str
+    attributes: Dict[str, Any]
+    inputs: Any
+    outputs: Any
+    start_ns: int
+    end_ns: int
+    chat_messages: Optional[List[Dict[str, Any]]] = None
+
+
+@dataclass
+class _SpanQueue:
+    """
+    Accumulates spans for one trace so they can be emitted in a single pass.
+
+    Spans are keyed locally, so children can reference a parent before MLflow
+    has assigned it a span_id. A parent_key of None attaches to parent_id.
+    """
+    request_id: str
+    parent_id: str
+    spans: List[_SpanRecord] = field(default_factory=list)
+
+    def add(
+        self,
+        name: str,
+        parent_key: Optional[str],
+        span_type: str,
+        attributes: Dict[str, Any],
+        inputs: Any,
+        outputs: Any,
+        start_ns: int,
+        end_ns: int,
+        chat_messages: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """Queue a span and return its local key."""
+        key = uuid4().hex[:16]
+        self.spans.append(_SpanRecord(
+            key, name, parent_key, span_type, attributes,
+            inputs, outputs, start_ns, end_ns, chat_messages
+        ))
+        return key
+
+    def flush(self, client: MlflowClient) -> None:
+        """
+        Emit all queued spans, starting each parent before its children and ending it after them.
+
+        Spans whose parent_key never resolves are skipped with a warning.
+        """
+        children: Dict[Optional[str], List[_SpanRecord]] = {}
+        for record in self.spans:
+            children.setdefault(record.parent_key, []).append(record)
+        emitted = self._emit(client, children, None, self.parent_id)
+        if emitted < len(self.spans):
+            logger.warning(
+                "Skipped %d BAML spans with an unknown parent in trace %s",
+                len(self.spans) - emitted, self.request_id
+            )
+        self.spans = []
+
+    def _emit(
+        self,
+        client: MlflowClient,
+        children: Dict[Optional[str], List[_SpanRecord]],
+        parent_key: Optional[str],
+        parent_id: str
+    ) -> int:
+        """Emit the subtree under parent_key and return the number of spans emitted."""
+        emitted = 0
+        for record in children.get(parent_key, []):
+            span = client.start_span(
+                name=record.name,
+                request_id=self.request_id,
+                parent_id=parent_id,
+                span_type=record.span_type,
+                inputs=record.inputs,
+                attributes=record.attributes,
+                start_time_ns=record.start_ns
+            )
+            if record.chat_messages is not None:
+                set_span_chat_messages(span, record.chat_messages)
+            emitted += 1 + self._emit(client, children, record.key, span.span_id)
+            client.end_span(
+                request_id=self.request_id,
+                span_id=span.span_id,
+                outputs=record.outputs,
+                end_time_ns=record.end_ns
+            )
+        return emitted
+
+
+def _resolve_parent(client: MlflowClient, request_id: str, parent_id: Optional[str]) -> str:
+    """Return parent_id, or the root span of request_id fetched from MLflow if it is None."""
+    if parent_id is None:
+        trace_obj = client.get_trace(request_id)
+        parent_id = trace_obj.root_span_id
+    return parent_id
+
+
+def _export_logs(
+    logs: List[Any],
+    request_id: str,
+    parent_id: Optional[str],
+    inputs: Dict[str, Any],
+    thread_name: str
+) -> None:
+    """
+    Emit MLflow spans for the BAML logs of one traced call.
+
+    Runs on the export thread. If parent_id is None, the root span of
+    request_id is fetched from MLflow. inputs is the function span's inputs,
+    snapshotted by the caller with _span_inputs. thread_name is the thread that ran the call.
+    """
+    client = _get_client()
+    spans = _SpanQueue(request_id=request_id, parent_id=_resolve_parent(client, request_id, parent_id))
+    for log in logs:
+        log_start_ns = log.timing.start_time_utc_ms * 1_000_000
+        log_end_ns = log_start_ns + log.timing.duration_ms * 1_000_000
+        usage = log.usage
+        func_key = spans.add(
+            name=log.function_name,
+            parent_key=None,
+            span_type=SpanType.AGENT,
+            inputs=inputs,
+            attributes={
+                "baml.id": log.id,
+                "baml.tokens_in": usage.input_tokens,
+                "baml.tokens_out": usage.output_tokens,
+                "host.name": _HOSTNAME,
+                "thread.name": thread_name
+            },
+            outputs={"out": log.raw_llm_response},
+            start_ns=log_start_ns,
+            end_ns=log_end_ns
+        )
+
+        for call in log.calls:
+            call_start_ns = call.timing.start_time_utc_ms * 1_000_000
+            call_end_ns = call_start_ns + call.timing.duration_ms * 1_000_000
+            resp = call.http_response
+            call_usage = call.usage
+            req_body = _json_loads(call.http_request.body.text())
+            resp_body = _json_loads(resp.body.text())
+            spans.add(
+                name=f"LLMCall:{call.provider}",
+                parent_key=func_key,
+                span_type=SpanType.CHAT_MODEL,
+                inputs=req_body,
+                attributes={
+                    "status": resp.status,
+                    "tokens_in": call_usage.input_tokens,
+                    "tokens_out": call_usage.output_tokens
+                },
+                outputs={"resp": resp_body},
+                start_ns=call_start_ns,
+                end_ns=call_end_ns,
+                chat_messages=[*req_body["messages"], resp_body["choices"][0]["message"]]
+            )
+            # Optionally attach tools: set_span_chat_tools(cs, call.chat_tools)
+
+    spans.flush(client)
+
+
+def _export_cache_hit(
+    func_name: str,
+    request_id: str,
+    parent_id: Optional[str],
+    inputs: Dict[str, Any],
+    outputs: Dict[str, Any],
+    time_ns: int,
+    thread_name: str
+) -> None:
+    """Emit a single span marking a call answered from the result cache, from caller-side snapshots."""
+    client = _get_client()
+    spans = _SpanQueue(request_id=request_id, parent_id=_resolve_parent(client, request_id, parent_id))
+    spans.add(
+        name=func_name,
+        parent_key=None,
+        span_type=SpanType.AGENT,
+        inputs=inputs,
+        attributes={"cache": "hit", "host.name": _HOSTNAME, "thread.name": thread_name},
+        outputs=outputs,
+        start_ns=time_ns,
+        end_ns=time_ns
+    )
+    spans.flush(client)
+
+
+@overload
+def start_baml_trace(
+    experiment: str,
+    with_collector: Literal[False] = False
+) -> ContextManager[Tuple[str, str]]: ...
+
+
+@overload
+def start_baml_trace(
+    experiment: str,
+    with_collector: Literal[True]
+) -> ContextManager[Tuple[str, str, Collector]]: ...
+
+
+def start_baml_trace(
+    experiment: str,
+    with_collector: bool = False
+) -> ContextManager[Union[Tuple[str, str], Tuple[str, str, Collector]]]:
     """
     Context manager for grouping multiple BAML calls into a single MLflow trace.
 
     Args:
         experiment (str): Name of the MLflow experiment.
+        with_collector (bool): Also yield a Collector shared by the calls in this
+            trace, whose token totals are logged as the trace outputs. Defaults to False.
 
     Yields:
-        Tuple[str, str]: A tuple of (request_id, root_span_id) for the active trace.
+        Tuple[str, str]: A tuple of (request_id, root_span_id) for the active trace,
+            or (request_id, root_span_id, collector) if with_collector is True.
     """
-    set_experiment(experiment)
-    client = MlflowClient()
+    return _start_baml_trace(experiment, with_collector)
+
+
+@contextmanager
+def _start_baml_trace(
+    experiment: str,
+    with_collector: bool
+) -> Iterator[Union[Tuple[str, str], Tuple[str, str, Collector]]]:
+    """Implementation of start_baml_trace; the public overloads give each mode its own yield type."""
+    experiment_id = _set_experiment(experiment)
+    client = _get_client()
     root_span = client.start_trace(
         name="baml_trace",
         tags={"experiment": experiment},
         span_type=SpanType.CHAIN,
-        inputs={}
+        inputs={},
+        experiment_id=experiment_id
     )
     request_id: str = root_span.request_id
     root_span_id: str = root_span.span_id
+    collector = Collector(name="baml_trace_collector") if with_collector else None
+    _REQ_ROOT[request_id] = root_span_id
     try:
-        yield request_id, root_span_id
+        if collector is None:
+            yield request_id, root_span_id
+        else:
+            yield request_id, root_span_id, collector
     finally:
-        client.end_trace(request_id=request_id)
+        outputs = None
+        if collector is not None:
+            outputs = {
+                "total_input_tokens": collector.usage.input_tokens,
+                "total_output_tokens": collector.usage.output_tokens
+            }
+        # Queued behind this trace's span exports, so every span is closed first
+        _EXPORT_QUEUE.put(partial(
+            client.end_trace, request_id=request_id, outputs=outputs, end_time_ns=time.time_ns()
+        ))
+        _REQ_ROOT.pop(request_id, None)
 
 
 def trace_baml_function(
@@ -46,19 +504,31 @@ def trace_baml_function(
     *args: Any,
     request_id: Optional[str] = None,
     parent_id: Optional[str] = None,
+    use_cache: bool = False,
+    collector: Optional[Collector] = None,
     **kwargs: Any
 ) -> Any:
     """
     Trace a BAML function call and log its activity to MLflow.
 
-    If request_id is None, starts a standalone trace using the function's name.
-    If parent_id is None, fetches the root span ID for the given request_id.
+    If request_id is None, starts a standalone trace using the function's name, for
+    the fraction of calls set by the BAML_TRACE_SAMPLE_RATE environment variable.
+    If parent_id is None, uses the root span ID for the given request_id, which is
+    known locally for traces opened by start_baml_trace and fetched from MLflow otherwise.
+
+    Spans are exported on a background thread, so this returns as soon as func does.
+    With use_cache, a repeat call with the same function, client and arguments returns
+    the earlier result without calling the LLM, and is logged as a span marked as a cache
+    hit. Calls whose arguments can't be serialized to JSON are never cached.
 
     Args:
         func (Callable[..., Any]): The BAML client function to invoke.
         *args: Positional arguments passed to func.
         request_id (Optional[str]): MLflow trace request_id. Defaults to None.
         parent_id (Optional[str]): Parent span ID for new spans. Defaults to None.
+        use_cache (bool): Reuse results of identical earlier calls. Defaults to False.
+        collector (Optional[Collector]): Shared collector from start_baml_trace that
+            also records this call. Defaults to None.
         **kwargs: Keyword arguments passed to func.
 
     Returns:
@@ -66,72 +536,147 @@ def trace_baml_function(
     """
     # Start standalone trace if no request_id
     if request_id is None:
+        # Head-based sampling, decided once for the whole trace
+        if random.random() >= BAML_TRACE_SAMPLE_RATE:
+            return _trace_with_ids(func, args, kwargs, None, None, use_cache, collector)
         with start_baml_trace(func.__name__) as (rid, pid):
-            return trace_baml_function(
-                func, *args, request_id=rid, parent_id=pid, **kwargs
-            )
+            return _trace_with_ids(func, args, kwargs, rid, pid, use_cache, collector)
+    return _trace_with_ids(func, args, kwargs, request_id, parent_id, use_cache, collector)
 
-    client = MlflowClient()
-    # Lookup root span if parent_id not provided
-    if parent_id is None:
-        trace_obj = client.get_trace(request_id)
-        parent_id = trace_obj.root_span_id
 
-    try:
-        collector = Collector(name="baml_collector")
-        result: Any = func(*args, baml_options={"collector": collector}, **kwargs)
+async def a_trace_baml_function(
+    func: Callable[..., Any],
+    *args: Any,
+    request_id: Optional[str] = None,
+    parent_id: Optional[str] = None,
+    use_cache: bool = False,
+    collector: Optional[Collector] = None,
+    **kwargs: Any
+) -> Any:
+    """
+    Async variant of trace_baml_function for running independent BAML calls concurrently.
 
-        for log in collector.logs:
-            func_span = client.start_span(
-                name=log.function_name,
-                request_id=request_id,
-                parent_id=parent_id,
-                span_type=SpanType.AGENT,
-                inputs={'args': args, 'kwargs': kwargs},
-                attributes={
-                    "baml.id": log.id,
-                    "baml.tokens_in": log.usage.input_tokens,
-                    "baml.tokens_out": log.usage.output_tokens
-                },
-                start_time_ns=log.timing.start_time_utc_ms * 1_000_000
-            )
+    The synchronous BAML function runs in the event loop's default executor, so
+    several calls can be awaited together, e.g. with asyncio.gather.
 
-            for call in log.calls:
-                cs = client.start_span(
-                    name=f"LLMCall:{call.provider}",
-                    request_id=request_id,
-                    parent_id=func_span.span_id,
-                    inputs=call.http_request.body.json(),
-                    attributes={
-                        "status": call.http_response.status,
-                        "tokens_in": call.usage.input_tokens,
-                        "tokens_out": call.usage.output_tokens
-                    },
-                    start_time_ns=call.timing.start_time_utc_ms * 1_000_000,
-                    span_type=SpanType.CHAT_MODEL
-                )
-                set_span_chat_messages(
-                    cs,
-                    call.http_request.body.json()["messages"] +
-                    [call.http_response.body.json()["choices"][0]["message"]]
-                )
-                # Optionally attach tools: set_span_chat_tools(cs, call.chat_tools)
-
-                client.end_span(
-                    request_id=request_id,
-                    span_id=cs.span_id,
-                    outputs={"resp": call.http_response.body.json()},
-                    end_time_ns=(call.timing.start_time_utc_ms + call.timing.duration_ms) * 1_000_000
-                )
+    Args:
+        func (Callable[..., Any]): The BAML client function to invoke.
+        *args: Positional arguments passed to func.
+        request_id (Optional[str]): MLflow trace request_id. Defaults to None.
+        parent_id (Optional[str]): Parent span ID for new spans. Defaults to None.
+        use_cache (bool): Reuse results of identical earlier calls. Defaults to False.
+        collector (Optional[Collector]): Shared collector from start_baml_trace that
+            also records this call. Defaults to None.
+        **kwargs: Keyword arguments passed to func.
 
-            client.end_span(
-                request_id=request_id,
-                span_id=func_span.span_id,
-                outputs={"out": log.raw_llm_response},
-                end_time_ns=(log.timing.start_time_utc_ms + log.timing.duration_ms) * 1_000_000
+    Returns:
+        Any: Result of the BAML function, or error info if a BAML error occurs.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(
+        trace_baml_function, func, *args,
+        request_id=request_id, parent_id=parent_id, use_cache=use_cache,
+        collector=collector, **kwargs
+    ))
+
+
+async def a_trace_baml_batch(
+    func: Callable[..., Any],
+    inputs: Iterable[Any],
+    *args: Any,
+    max_concurrency: int = 8,
+    request_id: Optional[str] = None,
+    parent_id: Optional[str] = None,
+    use_cache: bool = False,
+    collector: Optional[Collector] = None,
+    **kwargs: Any
+) -> List[Any]:
+    """
+    Trace one BAML call per input, running up to max_concurrency calls at a time.
+
+    Each input is passed as the first positional argument to func, followed by
+    any shared *args and **kwargs. Every call gets its own span, as with
+    a_trace_baml_function.
+
+    Args:
+        func (Callable[..., Any]): The BAML client function to invoke.
+        inputs (Iterable[Any]): First positional argument for each call.
+        *args: Additional positional arguments passed to every call.
+        max_concurrency (int): Maximum number of calls in flight. Defaults to 8.
+        request_id (Optional[str]): MLflow trace request_id. Defaults to None.
+        parent_id (Optional[str]): Parent span ID for new spans. Defaults to None.
+        use_cache (bool): Reuse results of identical earlier calls. Defaults to False.
+        collector (Optional[Collector]): Shared collector from start_baml_trace that
+            also records this call. Defaults to None.
+        **kwargs: Keyword arguments passed to every call.
+
+    Returns:
+        List[Any]: Results in the same order as inputs.
+
+    Raises:
+        ValueError: If max_concurrency is less than 1.
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(item: Any) -> Any:
+        async with semaphore:
+            return await a_trace_baml_function(
+                func, item, *args,
+                request_id=request_id, parent_id=parent_id, use_cache=use_cache,
+                collector=collector, **kwargs
             )
+
+    return list(await asyncio.gather(*(run_one(item) for item in inputs)))
+
+
+def _trace_with_ids(
+    func: Callable[..., Any],
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any],
+    request_id: Optional[str],
+    parent_id: Optional[str],
+    use_cache: bool = False,
+    collector: Optional[Collector] = None
+) -> Any:
+    """Invoke func and queue its spans under an already-open trace, or untraced if request_id is None."""
+    # Lookup root span if parent_id not provided
+    if parent_id is None and request_id is not None:
+        parent_id = _REQ_ROOT.get(request_id)
+
+    key = _cache_key(func, args, kwargs) if use_cache else None
+    if key is not None:
+        hit, cached = _cache_get(key)
+        if hit:
+            if request_id is not None:
+                _EXPORT_QUEUE.put(partial(
+                    _export_cache_hit, func.__name__, request_id, parent_id,
+                    _span_inputs(args, kwargs), {"out": _truncate_for_span(cached)},
+                    time.time_ns(), threading.current_thread().name
+                ))
+            return cached
+
+    collectors: List[Collector] = [] if collector is None else [collector]
+    try:
+        if request_id is None:
+            result: Any = func(*args, baml_options={"collector": collectors}, **kwargs)
+        else:
+            # Spans come from a per-call collector even when a shared one is passed in:
+            # the shared collector also holds the logs of concurrent calls in the trace,
+            # and nothing in a log says which call it came from. The known cost is
+            # registering two collectors for traced calls that share one.
+            call_collector = Collector(name="baml_collector")
+            collectors.append(call_collector)
+            result = func(*args, baml_options={"collector": collectors}, **kwargs)
+            _EXPORT_QUEUE.put(partial(
+                _export_logs, call_collector.logs, request_id, parent_id,
+                _span_inputs(args, kwargs), threading.current_thread().name
+            ))
+        if key is not None:
+            _cache_put(key, result)
     except BamlError as e:
-        print(f"BAML Error: {e}")
+        logger.error("BAML Error: %s", e)
         result = [{"error": str(e), "traceback": traceback.format_exc()}]
     return result
 
@@ -140,6 +685,12 @@ def main() -> None:
     """
     Demonstrate standalone and multi-call tracing for BAML functions.
     """
+    def format_items(items: Iterable[Any]) -> str:
+        """Format inventory items one per line, for printing with a single write."""
+        return "".join(
+            f"{i.item}: {i.quantity} units at ${i.price} each (SKU: {i.sku})\n" for i in items
+        )
+
     inventory_text: str = '''
     Current Stock:
     - Apples: 100 units, $0.50 each, SKU: APL123
@@ -151,8 +702,7 @@ def main() -> None:
     # Standalone trace example
     items_single = trace_baml_function(b.ListInventory, inventory_text)
     print("Single-call trace items:")
-    for item in items_single:
-        print(f"{item.item}: {item.quantity} units at ${item.price} each (SKU: {item.sku})")
+    sys.stdout.write(format_items(items_single))
 
     # Multi-call trace example
     with start_baml_trace("baml_inventory_multi") as (req_id, root_id):
@@ -171,12 +721,10 @@ def main() -> None:
         )
 
     print("Multi-call trace initial items:")
-    for item in items1:
-        print(f"{item.item}: {item.quantity} units at ${item.price} each (SKU: {item.sku})")
+    sys.stdout.write(format_items(items1))
 
     print("Multi-call trace updated items:")
-    for item in items2:
-        print(f"{item.item}: {item.quantity} units at ${item.price} each (SKU: {item.sku})")
+    sys.stdout.write(format_items(items2))
 
 
 if __name__ == '__main__':